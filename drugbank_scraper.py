@@ -1,7 +1,54 @@
-import requests
-from bs4 import BeautifulSoup
+import httpx
+from lxml import html
+from lxml.etree import XPath
 import psycopg2
 import argparse
+import asyncio
+import csv
+import io
+import os
+import queue
+import random
+import threading
+
+# Cap on concurrent requests to Drugbank. With HTTP/2 these multiplex over
+# a handful of connections, so the cap is about being polite to the server
+# rather than socket count.
+MAX_INFLIGHT_REQUESTS = 20
+
+# httpx builds Accept-Encoding itself from the decoders it can actually
+# handle (advertising brotli only when the brotli package is importable),
+# so we must not override it: hardcoding "br" without the decoder would
+# cache raw brotli bytes as HTML. The User-Agent identifies us honestly
+# instead of the library default.
+_REQUEST_HEADERS = {
+    "User-Agent": "drugbank-scraper/1.0",
+}
+
+# Raw pages are cached here keyed by identifier, so re-runs (and iterating
+# on the extraction code) don't re-download from Drugbank. Delete the
+# directory to force fresh downloads.
+CACHE_DIR = ".drugbank_cache"
+
+# The scrape/insert pipeline flushes rows to the database in batches of
+# this many drugs, and the queue between the two sides is bounded so
+# memory stays capped no matter how many identifiers we're given.
+INSERT_BATCH_SIZE = 1000
+SCRAPE_QUEUE_MAXSIZE = 200
+
+# XPath expressions compiled once at import time; evaluation then happens
+# entirely inside libxml2 rather than via Python-level tree walking.
+_SMILES_SECTION_XPATH = XPath("//*[@id='smiles']/following-sibling::*[1]")
+_CF_EMAIL_XPATH = XPath(".//*[contains(@class, '__cf_email__')]")
+_TARGETS_XPATH = XPath("//*[@id='targets']//*[contains(@class, 'card-body')]")
+_GENE_NAME_XPATH = XPath(".//*[@id='gene-name']/following-sibling::*[1]")
+_ACTIONS_XPATH = XPath(
+    ".//*[@id='actions']/following-sibling::*[1]//*[contains(@class, 'badge')]"
+)
+_EXTERNAL_LINKS_DL_XPATH = XPath("//*[@id='external-links']/following-sibling::*[1]//dl")
+
+# Ignoring a few sources for this MVP that don't give obvious alternate IDs.
+_SKIPPED_EXTERNAL_SOURCES = frozenset({"RxList", "Drugs.com", "PDRhealth"})
 
 
 def get_smiles(parsed_drug_doc):
@@ -19,24 +66,23 @@ def get_smiles(parsed_drug_doc):
     """
 
     # Source: https://stackoverflow.com/questions/36911296/scraping-of-protected-email
+    # The payload is hex: one key byte followed by the key-XORed message bytes.
     def decode_email(e):
-        de = ""
-        k = int(e[:2], 16)
+        data = bytes.fromhex(e)
+        key = data[0]
 
-        for i in range(2, len(e)-1, 2):
-            de += chr(int(e[i:i+2], 16)^k)
+        return bytes(b ^ key for b in data[1:]).decode('ascii')
 
-        return de
+    smiles_section = _SMILES_SECTION_XPATH(parsed_drug_doc)[0]
 
-    email_protected_map = {}
-    for email_protected in parsed_drug_doc.find_all(class_="__cf_email__"):
-        email_protected_map[str(email_protected)] = decode_email(email_protected["data-cfemail"])
+    # Swap each obfuscated span's text for the decoded value directly in the
+    # tree, so we never re-serialize and re-parse the fragment.
+    for email_protected in _CF_EMAIL_XPATH(smiles_section):
+        email_protected.text = decode_email(email_protected.get("data-cfemail"))
 
-    unencrypted_string = str(parsed_drug_doc.find(id="smiles").next_sibling)
-    for href, unencrypted in email_protected_map.items():
-        unencrypted_string = unencrypted_string.replace(href, unencrypted)
-
-    smile_result = BeautifulSoup(unencrypted_string, 'html.parser').text
+    # Reading text off the tree keeps any surrounding whitespace that the
+    # old fragment re-parse used to normalize away.
+    smile_result = smiles_section.text_content().strip()
 
     if smile_result == "Not Available":
         smile_result = None
@@ -54,22 +100,19 @@ def get_gene_action_pairs(parsed_drug_doc):
     """
 
     gene_action_pairs = []
-    for target in parsed_drug_doc.select('#targets .card-body'):
+    for target in _TARGETS_XPATH(parsed_drug_doc):
         # We may have zero or one gene names.
-        gene_name_section = target.find(id='gene-name')
+        gene_name_section = _GENE_NAME_XPATH(target)
         if gene_name_section:
-            gene_name = gene_name_section.next_sibling.text
-
-            actions_section = target.find(id='actions')
+            gene_name = gene_name_section[0].text_content()
 
-            # We may be missing actions but have gene name.
-            if not actions_section:
+            # We may have zero or many actions for the gene name.
+            actions = _ACTIONS_XPATH(target)
+            if not actions:
                 gene_action_pairs.append((gene_name, None))
             else:
-                # We may have multiple actions.
-                actions = actions_section.next_sibling.find_all(class_="badge")
                 for action in actions:
-                    gene_action_pairs.append((gene_name, action.text))
+                    gene_action_pairs.append((gene_name, action.text_content()))
         else:
             # Skip recording information if we don't have a gene name.
             pass
@@ -84,25 +127,105 @@ def get_external_links(parsed_drug_doc):
     Finds the section using the id "external-links".
     """
 
-    external_link_info = list(parsed_drug_doc.find(id='external-links').next_sibling.dl.children)
+    # Pair the dt/dd tags up directly rather than relying on the sources and
+    # values landing at even/odd offsets of the dl's child list.
+    external_link_dl = _EXTERNAL_LINKS_DL_XPATH(parsed_drug_doc)[0]
     external_links = {}
-    for i in range(0, len(external_link_info), 2):
-        source = external_link_info[i].text
-        value = external_link_info[i+1].text
-        # Ignoring a few sources for this MVP that don't give obvious alternate IDs.
-        if source not in ["RxList", "Drugs.com", "PDRhealth"]:
-            external_links[source] = value
+    for source_dt, value_dd in zip(external_link_dl.findall("dt"),
+                                   external_link_dl.findall("dd")):
+        source = source_dt.text_content()
+        if source not in _SKIPPED_EXTERNAL_SOURCES:
+            external_links[source] = value_dd.text_content()
 
     return external_links
 
 
-def get_info_for_identifier(identifier):
+async def fetch_drug_page(client, identifier):
     """
-    Retrieves a set of information for a given Drugbank drug identifier.
+    Returns the path to the cached HTML for a drug page, downloading it
+    only if it isn't already in the local cache.
+
+    The response body is streamed straight into the cache file in chunks,
+    so a page is never fully buffered in memory on the way down. We cache
+    the HTML rather than the extracted info so that changes to the
+    extraction code take effect without re-downloading anything.
     """
 
-    page = requests.get(f"https://www.drugbank.ca/drugs/{identifier}")
-    parsed_drug_doc = BeautifulSoup(page.text, 'html.parser')
+    cache_path = os.path.join(CACHE_DIR, f"{identifier}.html")
+    if os.path.exists(cache_path):
+        return cache_path
+
+    # Stagger requests a little so we don't hit Drugbank in lockstep.
+    await asyncio.sleep(random.uniform(0, 0.25))
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # Stream into a temp file and only rename it to the real cache path
+    # once the download completes, so an interrupted fetch can't leave a
+    # truncated page that later runs would accept as cached.
+    partial_path = f"{cache_path}.part"
+    try:
+        async with client.stream("GET", f"https://www.drugbank.ca/drugs/{identifier}") as page:
+            # Never cache an error page: a 404/429/5xx body written to the
+            # cache would be silently served as the drug page on every later
+            # run. Failing here leaves the cache empty so the next run retries.
+            page.raise_for_status()
+
+            with open(partial_path, "wb") as page_file:
+                async for chunk in page.aiter_bytes():
+                    page_file.write(chunk)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    os.replace(partial_path, cache_path)
+
+    return cache_path
+
+
+async def scrape_identifiers(identifiers, work_queue):
+    """
+    Fetches and parses all the drug pages concurrently, pushing
+    (drug_id, info) items onto the work queue followed by a None sentinel.
+
+    The fetches share a single event loop and HTTP/2 client, so many
+    requests stay in flight over a few multiplexed connections without
+    per-request threads. Parsing is CPU-bound, so each page is handed to
+    a worker thread and overlaps with the remaining fetches.
+    """
+
+    loop_limits = httpx.Limits(max_connections=MAX_INFLIGHT_REQUESTS)
+
+    try:
+        async with httpx.AsyncClient(http2=True, limits=loop_limits, timeout=30,
+                                     headers=_REQUEST_HEADERS) as client:
+
+            async def scrape(drug_id, identifier):
+                page_path = await fetch_drug_page(client, identifier)
+                info = await asyncio.to_thread(get_info_for_identifier, identifier, page_path)
+                # queue.Queue.put blocks when the insert side falls behind, so
+                # keep it off the event loop as well.
+                await asyncio.to_thread(work_queue.put, (drug_id, info))
+
+            await asyncio.gather(*(
+                scrape(drug_id, identifier) for drug_id, identifier in enumerate(identifiers)
+            ))
+    finally:
+        # Always deliver the sentinel, even when a scrape raised, so the
+        # insert side can't block forever waiting on a dead producer.
+        work_queue.put(None)
+
+
+def get_info_for_identifier(identifier, page_path):
+    """
+    Extracts the set of information for a Drugbank drug identifier from
+    its downloaded page.
+    """
+
+    # lxml reads the file incrementally and sniffs the encoding itself, so
+    # there's no Python-level decode pass or second in-memory copy.
+    parsed_drug_doc = html.parse(page_path).getroot()
 
     smiles = get_smiles(parsed_drug_doc)
     gene_action_pairs = get_gene_action_pairs(parsed_drug_doc)
@@ -132,68 +255,186 @@ def get_postgres_conn_and_cursor(user, password, host):
     return conn, cursor
 
 
-def transact_drug_info(identifiers, user, password, host):
+def copy_rows(cursor, copy_sql, rows):
     """
-    Retrieves the info from Drugbank for the provided identifiers,
-    prepares insert statements for the info and then performs them.
+    Bulk-loads rows through COPY FROM STDIN, staged as CSV in memory.
 
-    NOTE: Will fail if the data is already present.
+    COPY skips the per-row SQL parse/plan path entirely, so it stays fast
+    even when the identifier list grows to thousands of drugs. None values
+    come out of csv as empty fields, which the NULL '' clause in the COPY
+    statements maps back to SQL NULL.
     """
 
-    drug_info = []
-    for identifier in identifiers:
-        drug_info.append(get_info_for_identifier(identifier))
-
-    def xform_for_insert(t):
-        return str(t).replace('"', "'").replace("None", "NULL")
-
-    drugs_txs = []
-    gene_action_pairs_txs = []
-    alternate_identifiers_txs = []
-    for i, drug_info in enumerate(drug_info):
-        drugs_txs.append(
-            xform_for_insert((i, drug_info["smiles"]))
-        )
-
-        gene_action_pairs = drug_info["gene_action_pairs"]
-        for pair in gene_action_pairs:
-            gene_action_pairs_txs.append(
-                xform_for_insert((i, pair[0], pair[1]))
-            )
-
-        external_links = drug_info["external_links"]
-        for identifier_source, identifier_value in external_links.items():
-            alternate_identifiers_txs.append(
-                xform_for_insert((i, identifier_source, identifier_value))
-            )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    buffer.seek(0)
 
-    drugs_insert = f"""INSERT INTO drug_info.drugs
-                        (drug_id, smiles) VALUES
-                        {', '.join(drugs_txs)};
-                    """
+    cursor.copy_expert(copy_sql, buffer)
 
-    alt_ids_insert = f"""INSERT INTO drug_info.alternate_identifiers
-                        (drug_id, identifier_source, identifier_value) VALUES
-                        {', '.join(alternate_identifiers_txs)};
-                    """
 
-    gene_actions_insert = f"""INSERT INTO drug_info.gene_actions
-                                (drug_id, gene_name, gene_action) VALUES
-                                {', '.join(gene_action_pairs_txs)};
-                            """
+def transact_drug_info(identifiers, user, password, host):
+    """
+    Retrieves the info from Drugbank for the provided identifiers and
+    loads it into the database.
+
+    Scraping and inserting run as a pipeline: fetch workers push parsed
+    drugs onto a bounded queue while this thread drains it and streams
+    batches into the database via COPY, all on one connection in a single
+    transaction. Memory stays capped by the queue and batch sizes rather
+    than growing with the identifier list.
+
+    Rows that already exist are skipped during the staging-table merges, so
+    the load is idempotent: re-running after a failure, or with new
+    identifiers appended to the list, only pays for net-new rows.
+    """
 
+    work_queue = queue.Queue(maxsize=SCRAPE_QUEUE_MAXSIZE)
+    producer_errors = []
+
+    def produce():
+        # drug_ids are assigned by each identifier's position in the input
+        # list before scraping starts, so they stay stable even though the
+        # scrapes finish out of order.
+        try:
+            asyncio.run(scrape_identifiers(identifiers, work_queue))
+        except Exception as error:
+            # Recorded here and re-raised on the main thread after the
+            # queue drains, so the failure isn't lost with this thread.
+            producer_errors.append(error)
+
+    # The connection is established before the producer starts so that a
+    # failure to connect can't strand scrape threads blocked on the queue.
     conn, cursor = get_postgres_conn_and_cursor(user, password, host)
 
-    cursor.execute(drugs_insert)
-    cursor.execute(alt_ids_insert)
-    cursor.execute(gene_actions_insert)
-
-    # cursor.execute("SELECT * FROM drug_info.drugs")
-    # print(cursor.fetchall())
-    # cursor.execute("SELECT * FROM drug_info.alternate_identifiers")
-    # print(cursor.fetchall())
-    # cursor.execute("SELECT * FROM drug_info.gene_actions")
-    # print(cursor.fetchall())
+    # Skip the WAL fsync wait on commit. Safe for this import: if the commit
+    # is lost to a crash we just re-run the script.
+    cursor.execute("SET LOCAL synchronous_commit = off")
+
+    # COPY can't skip duplicates, so each batch is staged into temp tables
+    # and merged into the real ones with the already-present rows filtered
+    # out. That makes re-runs and resumed imports only pay for net-new rows.
+    cursor.execute("""CREATE TEMPORARY TABLE staging_drugs (
+                        drug_id integer,
+                        smiles text
+                      ) ON COMMIT DROP;
+
+                      CREATE TEMPORARY TABLE staging_alternate_identifiers (
+                        drug_id integer,
+                        identifier_source text,
+                        identifier_value text
+                      ) ON COMMIT DROP;
+
+                      CREATE TEMPORARY TABLE staging_gene_actions (
+                        drug_id integer,
+                        gene_name text,
+                        gene_action text
+                      ) ON COMMIT DROP;
+                   """)
+
+    # Plain tuples of Python values; COPY's NULL '' clause handles None.
+    drugs_rows = []
+    gene_action_rows = []
+    alternate_identifier_rows = []
+
+    def flush_batches():
+        if drugs_rows:
+            copy_rows(
+                cursor,
+                "COPY staging_drugs (drug_id, smiles) FROM STDIN WITH (FORMAT csv, NULL '')",
+                drugs_rows
+            )
+            # The conflict targets name each table's re-run key explicitly;
+            # a bare DO NOTHING would also swallow hits on other unique
+            # constraints (e.g. two drugs sharing a SMILES), silently
+            # dropping rows their child rows still reference.
+            cursor.execute("""INSERT INTO drug_info.drugs (drug_id, smiles)
+                                SELECT drug_id, smiles FROM staging_drugs
+                                ON CONFLICT (drug_id) DO NOTHING;
+                              TRUNCATE staging_drugs;
+                           """)
+            drugs_rows.clear()
+        if alternate_identifier_rows:
+            copy_rows(
+                cursor,
+                """COPY staging_alternate_identifiers
+                    (drug_id, identifier_source, identifier_value)
+                    FROM STDIN WITH (FORMAT csv, NULL '')""",
+                alternate_identifier_rows
+            )
+            cursor.execute("""INSERT INTO drug_info.alternate_identifiers
+                                (drug_id, identifier_source, identifier_value)
+                                SELECT drug_id, identifier_source, identifier_value
+                                FROM staging_alternate_identifiers
+                                ON CONFLICT (identifier_source, identifier_value) DO NOTHING;
+                              TRUNCATE staging_alternate_identifiers;
+                           """)
+            alternate_identifier_rows.clear()
+        if gene_action_rows:
+            copy_rows(
+                cursor,
+                "COPY staging_gene_actions (drug_id, gene_name, gene_action) FROM STDIN WITH (FORMAT csv, NULL '')",
+                gene_action_rows
+            )
+            # An ON CONFLICT target can't make this table idempotent: the
+            # unique index treats NULL actions as distinct, and (gene, NULL)
+            # rows are a modeled case. A NULL-safe anti-join skips exactly
+            # the rows a re-run would duplicate, while a genuine collision —
+            # two drugs sharing a (gene_name, gene_action) pair — still
+            # trips the unique constraint and fails loudly.
+            cursor.execute("""INSERT INTO drug_info.gene_actions
+                                (drug_id, gene_name, gene_action)
+                                SELECT DISTINCT drug_id, gene_name, gene_action
+                                FROM staging_gene_actions staged
+                                WHERE NOT EXISTS (
+                                  SELECT 1 FROM drug_info.gene_actions existing
+                                  WHERE existing.drug_id = staged.drug_id
+                                    AND existing.gene_name = staged.gene_name
+                                    AND existing.gene_action IS NOT DISTINCT FROM staged.gene_action
+                                );
+                              TRUNCATE staging_gene_actions;
+                           """)
+            gene_action_rows.clear()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+
+    try:
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+
+            drug_id, info = item
+            drugs_rows.append((drug_id, info["smiles"]))
+
+            for gene_name, gene_action in info["gene_action_pairs"]:
+                gene_action_rows.append((drug_id, gene_name, gene_action))
+
+            for identifier_source, identifier_value in info["external_links"].items():
+                alternate_identifier_rows.append((drug_id, identifier_source, identifier_value))
+
+            if len(drugs_rows) >= INSERT_BATCH_SIZE:
+                flush_batches()
+
+        flush_batches()
+    finally:
+        # Keep draining until the producer has fully wound down, whether we
+        # got here via the sentinel, a database error, or an interrupt. The
+        # scrape puts run on non-daemon executor threads that are joined at
+        # shutdown, so any put left blocked on a full queue — including one
+        # the error-path sentinel overtook — would deadlock the join.
+        while producer.is_alive():
+            try:
+                work_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+    # Fail instead of committing a partial load if any scrape broke; the
+    # transaction is simply discarded and the script can be re-run.
+    if producer_errors:
+        raise producer_errors[0]
 
     conn.commit()
 
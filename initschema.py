@@ -1,6 +1,35 @@
 import argparse
 import psycopg2
 
+# The whole schema is created in one multi-statement batch: a single
+# round-trip to the server, and all-or-nothing since DDL is transactional
+# in PostgreSQL. IF NOT EXISTS makes re-running the script a no-op.
+DDL = """CREATE SCHEMA IF NOT EXISTS drug_info;
+
+         CREATE TABLE IF NOT EXISTS drug_info.drugs (
+           drug_id integer PRIMARY KEY,
+           smiles text UNIQUE
+         );
+
+         CREATE TABLE IF NOT EXISTS drug_info.alternate_identifiers (
+           link_id SERIAL PRIMARY KEY,
+           drug_id integer,
+           CONSTRAINT drug_id FOREIGN KEY(drug_id) REFERENCES drug_info.drugs(drug_id),
+           identifier_source text,
+           identifier_value text,
+           UNIQUE(identifier_source, identifier_value)
+         );
+
+         CREATE TABLE IF NOT EXISTS drug_info.gene_actions (
+           action_id SERIAL PRIMARY KEY,
+           drug_id integer,
+           CONSTRAINT drug_id FOREIGN KEY(drug_id) REFERENCES drug_info.drugs(drug_id),
+           gene_name text,
+           gene_action text,
+           UNIQUE(gene_name, gene_action)
+         );
+      """
+
 # docker run --rm -e POSTGRES_PASSWORD=password -d -p 5432:5432 postgres
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -17,35 +46,9 @@ if __name__ == "__main__":
     conn = psycopg2.connect(user=user, password=password, host=host, connect_timeout=10)
     cursor = conn.cursor()
 
-    response = cursor.execute("""CREATE SCHEMA drug_info;""")
-
-    response = cursor.execute("""CREATE TABLE drug_info.drugs (
-                        drug_id integer PRIMARY KEY,
-                        smiles text UNIQUE
-                      );
-                   """)
-
-    response = cursor.execute("""CREATE TABLE drug_info.alternate_identifiers (
-                        link_id SERIAL PRIMARY KEY,
-                        drug_id integer,
-                        CONSTRAINT drug_id FOREIGN KEY(drug_id) REFERENCES drug_info.drugs(drug_id),
-                        identifier_source text,
-                        identifier_value text,
-                        UNIQUE(identifier_source, identifier_value)
-                      );
-                   """)
-
-    response = cursor.execute("""CREATE TABLE drug_info.gene_actions (
-                        action_id SERIAL PRIMARY KEY,
-                        drug_id integer,
-                        CONSTRAINT drug_id FOREIGN KEY(drug_id) REFERENCES drug_info.drugs(drug_id),
-                        gene_name text,
-                        gene_action text,
-                        UNIQUE(gene_name, gene_action)
-                      );
-                   """)
+    cursor.execute(DDL)
 
     conn.commit()
 
     cursor.close()
-    conn.close()
\ No newline at end of file
+    conn.close()